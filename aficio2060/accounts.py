@@ -27,9 +27,165 @@ restrictions (respectively).
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
 
 
-from suds.client import Client
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 import logging
+import operator
 import os, sys, traceback
+import weakref
+
+# Logging is set up once, when the module is imported.  suds' messages are
+# only shown if the environment variable SUDS_DEBUG is set.
+_SUDS_DEBUG = 'SUDS_DEBUG' in os.environ
+logging.basicConfig(level=logging.ERROR)
+logging.getLogger('suds.client').setLevel(logging.DEBUG)
+logging.disable(logging.NOTSET if _SUDS_DEBUG else logging.ERROR)
+
+# Parsing the WSDL is expensive, so each process only builds one suds client
+# per WSDL location and shares it between sessions.
+_CLIENT_CACHE = {}
+
+def _wsdl_mtime(wsdl):
+    """Return the modification time of the local WSDL file `wsdl`, or
+    ``None`` for remote URLs."""
+    if not wsdl.startswith("file://"):
+        return None
+    try:
+        return os.stat(wsdl[len("file://"):]).st_mtime
+    except OSError, e:
+        return None
+
+def _cache_location(wsdl_mtime):
+    """Return a directory for suds' on-disk cache that only the current user
+    can write to, or ``None`` if there is none.  suds' default location is
+    shared by all users, and the cache files are unpickled when read.
+
+    suds names its cache files after the WSDL URL only, so each modification
+    time `wsdl_mtime` of a local WSDL file gets a directory of its own.
+    """
+    location = os.path.join(os.path.expanduser('~'), '.cache', 'aficio2060',
+            'suds')
+    if wsdl_mtime is not None:
+        location = os.path.join(location, repr(wsdl_mtime))
+    try:
+        if not os.path.isdir(location):
+            os.makedirs(location, 0700)
+        st = os.stat(location)
+    except OSError, e:
+        return None
+    if st.st_uid != os.getuid() or st.st_mode & 022:
+        return None
+    return location
+
+def _get_client(wsdl):
+    """Return a suds client for `wsdl`.  The client is shared by all sessions
+    within the process, until the WSDL file changes."""
+    wsdl_mtime = _wsdl_mtime(wsdl)
+    key = (wsdl, wsdl_mtime)
+    client = _CLIENT_CACHE.get(key)
+    if client is None:
+        # Importing suds takes a while, so it is deferred until a session is
+        # actually opened.
+        from suds.client import Client
+        from suds.cache import ObjectCache
+        try:
+            from aficio2060.transport import RequestsTransport
+        except ImportError:
+            # Without requests, suds' own urllib2 based transport is used.
+            RequestsTransport = None
+        location = _cache_location(wsdl_mtime)
+        if location is not None:
+            cache = ObjectCache(location, days=7)
+        else:
+            cache = None
+        # cachingpolicy=1 caches the parsed WSDL objects across processes
+        # instead of just the XML documents.
+        if RequestsTransport is not None:
+            client = Client(wsdl, cache=cache, cachingpolicy=1,
+                    transport=RequestsTransport())
+        else:
+            client = Client(wsdl, cache=cache, cachingpolicy=1)
+        _CLIENT_CACHE[key] = client
+    return client
+
+# Field names of the user counter and user restriction objects.
+COUNTER_FIELDS = ("copyBlack", "copyBlackA3Over", "printerBlack",
+        "printerBlackA3Over", "scannerBlack", "scannerBlackA3Over")
+RESTRICT_FIELDS = ("copyBlack", "printerBlack", "scannerBlack", "localStorage")
+
+# Object ids of user counters and restrictions consist of these prefixes
+# followed by the user's internal name.
+COUNTER_OID_PREFIX = "111002"
+RESTRICT_OID_PREFIX = "110002"
+
+# (field name, field type) pairs for UpdateObject requests, in the order of
+# the field names above.
+_STATS_FIELD_TYPES = tuple((name, "DM_FIELD_UNSIGNED_INT")
+        for name in COUNTER_FIELDS)
+_RESTRICT_FIELD_TYPES = tuple((name, "DM_FIELD_ENUM") for name in RESTRICT_FIELDS)
+
+# The GetObject field list arguments, built once per tuple of field names.
+_FIELD_LISTS = {}
+
+def _field_list(field_names):
+    field_list = _FIELD_LISTS.get(field_names)
+    if field_list is None:
+        field_list = { "item" : list(field_names) }
+        _FIELD_LISTS[field_names] = field_list
+    return field_list
+
+class _cached_property(object):
+    """Read-only property whose getter is only called on first access.  The
+    result is stored in the instance dictionary, where it hides the
+    descriptor from then on."""
+
+    def __init__(self, getter):
+        self.getter = getter
+        self.__doc__ = getter.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = self.getter(obj)
+        obj.__dict__[self.getter.__name__] = value
+        return value
+
+class _LazyDict(dict):
+    """Dictionary which calls `fetch` with `owner` and the key to look up
+    missing keys and remembers the result.  Only a weak reference to `owner`
+    is kept, so that the dictionary can be stored on it without creating a
+    reference cycle."""
+
+    def __init__(self, fetch, owner):
+        dict.__init__(self)
+        self.fetch = fetch
+        self.owner = weakref.ref(owner)
+
+    def __missing__(self, key):
+        owner = self.owner()
+        if owner is None:
+            raise KeyError(key)
+        value = self.fetch(owner, key)
+        self[key] = value
+        return value
+
+def _as_list(obj):
+    """suds unmarshals a repeated element into a list, but a single occurrence
+    into a plain object.  Always return a list."""
+    if isinstance(obj, list):
+        return obj
+    return [obj]
+
+def _field_items(obj):
+    """Return the fields of the GetObject reply `obj` as a list of (field
+    name, value) pairs, or an empty list if it has no field list.  The suds
+    objects are walked only once; all further parsing works on the pairs."""
+    # An empty <fieldList/> is unmarshalled as text without an item
+    # attribute.
+    items = getattr(getattr(obj, 'fieldList', None), 'item', None)
+    if items is None:
+        return []
+    return [(item.name, item.value) for item in _as_list(items)]
 
 class UserMaintError(RuntimeError):
     def __init__(self, msg, code=None):
@@ -54,16 +210,30 @@ class UserStatistics(object):
     The class tracks whether it was modified, using the `modified` attribute.
     Class users need to reset `modified` as needed.
     """
+    __slots__ = ('copy_a4', 'copy_a3', 'print_a4', 'print_a3', 'scan_a4',
+            'scan_a3', 'modified')
+
+    # Assigning to any of these attributes marks the instance as modified.
+    _TRACKED = frozenset(__slots__) - frozenset(('modified',))
+
+    # Position of each counter field in the constructor's arguments.
+    _FIELD_MAP = dict((name, idx) for idx, name in enumerate(COUNTER_FIELDS))
+
     def __init__(self, copy_a4=0, copy_a3=0, print_a4=0,
             print_a3=0, scan_a4=0, scan_a3=0):
-        self._copy_a4 = copy_a4
-        self._copy_a3 = copy_a3
-        self._print_a4 = print_a4
-        self._print_a3 = print_a3
-        self._scan_a4 = scan_a4
-        self._scan_a3 = scan_a3
+        object.__setattr__(self, 'copy_a4', copy_a4)
+        object.__setattr__(self, 'copy_a3', copy_a3)
+        object.__setattr__(self, 'print_a4', print_a4)
+        object.__setattr__(self, 'print_a3', print_a3)
+        object.__setattr__(self, 'scan_a4', scan_a4)
+        object.__setattr__(self, 'scan_a3', scan_a3)
         self.modified = False
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._TRACKED:
+            object.__setattr__(self, 'modified', True)
+
     def __repr__(self):
         return '<UserStatistics c%u,%u p%u,%u s%u,%u %s>' % (self.copy_a4,
                 self.copy_a3, self.print_a4, self.print_a3,
@@ -78,48 +248,6 @@ class UserStatistics(object):
         self.scan_a4 = 0
         self.scan_a3 = 0
 
-    def get_copy_a4(self):
-        return self._copy_a4
-    def set_copy_a4(self, val):
-        self.modified = True
-        self._copy_a4 = val
-    copy_a4 = property(get_copy_a4, set_copy_a4)
-
-    def get_copy_a3(self):
-        return self._copy_a3
-    def set_copy_a3(self, val):
-        self.modified = True
-        self._copy_a3 = val
-    copy_a3 = property(get_copy_a3, set_copy_a3)
-
-    def get_print_a4(self):
-        return self._print_a4
-    def set_print_a4(self, val):
-        self.modified = True
-        self._print_a4 = val
-    print_a4 = property(get_print_a4, set_print_a4)
-
-    def get_print_a3(self):
-        return self._print_a3
-    def set_print_a3(self, val):
-        self.modified = True
-        self._print_a3 = val
-    print_a3 = property(get_print_a3, set_print_a3)
-
-    def get_scan_a4(self):
-        return self._scan_a4
-    def set_scan_a4(self, val):
-        self.modified = True
-        self._scan_a4 = val
-    scan_a4 = property(get_scan_a4, set_scan_a4)
-
-    def get_scan_a3(self):
-        return self._scan_a3
-    def set_scan_a3(self, val):
-        self.modified = True
-        self._scan_a3 = val
-    scan_a3 = property(get_scan_a3, set_scan_a3)
-
     @property
     def copy_a4_total(self):
         return self.copy_a4 + (self.copy_a3 * 2)
@@ -133,44 +261,40 @@ class UserStatistics(object):
         return self.scan_a4 + (self.scan_a3 * 2)
 
     def is_zero(self):
-        return self.copy_a4_total == 0 and \
-                self.print_a4_total == 0 and \
-                self.scan_a4_total == 0
-                
+        # The counters are unsigned, so all totals are zero exactly if every
+        # single counter is.
+        return not (self.copy_a4 or self.copy_a3 or self.print_a4 or
+                self.print_a3 or self.scan_a4 or self.scan_a3)
+
 
     @staticmethod
     def from_soap_object(obj):
-        items = obj.fieldList.item
-        copy_a4 = 0
-        copy_a3 = 0
-        print_a4 = 0
-        print_a3 = 0
-        scan_a4 = 0
-        scan_a3 = 0
-        for item in items:
-            if item.name == "copyBlack":
-                copy_a4 = int(item.value)
-            if item.name == "copyBlackA3Over":
-                copy_a3 = int(item.value)
-            if item.name == "printerBlack":
-                print_a4 = int(item.value)
-            if item.name == "printerBlackA3Over":
-                print_a3 = int(item.value)
-            if item.name == "scannerBlack":
-                scan_a4 = int(item.value)
-            if item.name == "scannerBlackA3Over":
-                scan_a3 = int(item.value)
-        return UserStatistics(copy_a4, copy_a3, print_a4, print_a3, scan_a4, scan_a3)
-        
+        return UserStatistics.from_fields(_field_items(obj))
+
+    @classmethod
+    def from_fields(cls, fields):
+        """Create an unmodified instance from a sequence of (field name,
+        value) pairs, as read from a user counter object."""
+        return cls(*cls.values_from_fields(fields))
+
+    @classmethod
+    def values_from_fields(cls, fields):
+        """Return the list of counter values, in the order of the
+        constructor's arguments and :data:`COUNTER_FIELDS`, from a sequence of
+        (field name, value) pairs.  Missing counters are zero."""
+        field_map = cls._FIELD_MAP
+        vals = [0] * len(field_map)
+        for name, value in fields:
+            idx = field_map.get(name)
+            if idx is not None:
+                vals[idx] = int(value)
+        return vals
+
     def to_fieldList(self):
-        return { "item" : [
-            { "name" : "copyBlack", "value" : str(self.copy_a4), "type" : "DM_FIELD_UNSIGNED_INT" },
-            { "name" : "copyBlackA3Over", "value" : str(self.copy_a3), "type" : "DM_FIELD_UNSIGNED_INT" },
-            { "name" : "printerBlack", "value" : str(self.print_a4), "type" : "DM_FIELD_UNSIGNED_INT" },
-            { "name" : "printerBlackA3Over", "value" : str(self.print_a3), "type" : "DM_FIELD_UNSIGNED_INT" },
-            { "name" : "scannerBlack", "value" : str(self.scan_a4), "type" : "DM_FIELD_UNSIGNED_INT" },
-            { "name" : "scannerBlackA3Over", "value" : str(self.scan_a3), "type" : "DM_FIELD_UNSIGNED_INT" }
-        ]}
+        values = (self.copy_a4, self.copy_a3, self.print_a4, self.print_a3,
+                self.scan_a4, self.scan_a3)
+        return { "item" : [ { "name" : name, "value" : str(value), "type" : type }
+                for (name, type), value in zip(_STATS_FIELD_TYPES, values) ] }
 
 class UserRestrict(object):
     """This class represents a set of access restrictions.
@@ -187,50 +311,33 @@ class UserRestrict(object):
     It supports serialisation to and deserialisation from XML using
     :meth:`to_xml` and :meth:`from_xml`.
     """
+    __slots__ = ('grant_copy', 'grant_printer', 'grant_scanner',
+            'grant_storage', 'modified')
+
+    # Changing any of these attributes marks the instance as modified.
+    _TRACKED = frozenset(__slots__) - frozenset(('modified',))
+
+    # Position of each restriction field in the constructor's arguments.
+    _FIELD_MAP = dict((name, idx) for idx, name in enumerate(RESTRICT_FIELDS))
+
     def __init__(self, grant_copy=False, grant_printer=False,
             grant_scanner=False, grant_storage=False):
-        self._grant_copy = grant_copy
-        self._grant_printer = grant_printer
-        self._grant_scanner = grant_scanner
-        self._grant_storage = grant_storage
+        object.__setattr__(self, 'grant_copy', grant_copy)
+        object.__setattr__(self, 'grant_printer', grant_printer)
+        object.__setattr__(self, 'grant_scanner', grant_scanner)
+        object.__setattr__(self, 'grant_storage', grant_storage)
         self.modified = False
 
+    def __setattr__(self, name, value):
+        if name in self._TRACKED and \
+                value != getattr(self, name, None):
+            object.__setattr__(self, 'modified', True)
+        object.__setattr__(self, name, value)
+
     def __repr__(self):
         return '<UserRestrict c%d, p%d, s%d, st%d>' % (self.grant_copy,
                 self.grant_printer, self.grant_scanner, self.grant_storage)
     
-    def _get_grant_copy(self):
-        return self._grant_copy
-    def _set_grant_copy(self, copy):
-        if copy != self._grant_copy:
-            self.modified = True
-        self._grant_copy = copy
-    grant_copy = property(_get_grant_copy, _set_grant_copy)
-    
-    def _get_grant_printer(self):
-        return self._grant_printer
-    def _set_grant_printer(self, printer):
-        if printer != self._grant_printer:
-            self.modified = True
-        self._grant_printer = printer
-    grant_printer = property(_get_grant_printer, _set_grant_printer)
-    
-    def _get_grant_scanner(self):
-        return self._grant_scanner
-    def _set_grant_scanner(self, scanner):
-        if scanner != self._grant_scanner:
-            self.modified = True
-        self._grant_scanner = scanner
-    grant_scanner = property(_get_grant_scanner, _set_grant_scanner)
-    
-    def _get_grant_storage(self):
-        return self._grant_storage
-    def _set_grant_storage(self, storage):
-        if storage != self._grant_storage:
-            self.modified = True
-        self._grant_storage = storage
-    grant_storage = property(_get_grant_storage, _set_grant_storage)
-    
     def revoke_all(self):
         """Revoke all privileges."""
         self.grant_copy = False
@@ -245,57 +352,80 @@ class UserRestrict(object):
 
     @staticmethod
     def from_soap_object(obj):
-        items = obj.fieldList.item
-        grant_copy = False
-        grant_printer = False
-        grant_scanner = False
-        grant_storage = False
-        for item in items:
-            if item.name == "copyBlack" and item.value == "OFF":
-                grant_copy = True
-            if item.name == "printerBlack" and item.value == "OFF":
-                grant_printer = True
-            if item.name == "scannerBlack" and item.value == "OFF":
-                grant_scanner = True
-            if item.name == "localStorage" and item.value == "OFF":
-                grant_storage = True
-        return UserRestrict(grant_copy, grant_printer, grant_scanner, grant_storage)
+        return UserRestrict.from_fields(_field_items(obj))
+
+    @staticmethod
+    def from_fields(fields):
+        """Create an instance from a sequence of (field name, value) pairs."""
+        field_map = UserRestrict._FIELD_MAP
+        grants = [False] * 4
+        for name, value in fields:
+            idx = field_map.get(name)
+            if idx is not None and value == "OFF":
+                grants[idx] = True
+        return UserRestrict(*grants)
         
     def to_fieldList(self):
+        grants = (self.grant_copy, self.grant_printer, self.grant_scanner,
+                self.grant_storage)
         return { "item" : [
-            { "name" : "copyBlack", "value" : "OFF" if self.grant_copy else "ON", "type" : "DM_FIELD_ENUM" },
-            { "name" : "printerBlack", "value" : "OFF" if self.grant_printer else "ON", "type" : "DM_FIELD_ENUM" },
-            { "name" : "scannerBlack", "value" : "OFF" if self.grant_scanner else "ON", "type" : "DM_FIELD_ENUM" },
-            { "name" : "localStorage", "value" : "OFF" if self.grant_storage else "ON", "type" : "DM_FIELD_ENUM" }
-        ]}
+                { "name" : name, "value" : "OFF" if grant else "ON", "type" : type }
+                for (name, type), grant in zip(_RESTRICT_FIELD_TYPES, grants) ] }
+
+# Returns the tuple of all counters of a :class:`UserStatistics` instance, e.g.
+# for ``filter(lambda u: any(stats_nonzero_mask(u.stats)), users)``.
+stats_nonzero_mask = operator.attrgetter('copy_a4', 'copy_a3', 'print_a4',
+        'print_a3', 'scan_a4', 'scan_a3')
+
+# Marks User._orig_user_code as not set.
+_UNSET = object()
 
 class User(object):
     """This class represents a single user in the printer's user accounting.  It
     can have a user name `name`, a user code `user_code`, a set of access
     restrictions `restrict` of type :class:`UserRestrict` and printing
     statistics of type :class:`UserStatistics` associated with itsself.
+    Assigning new statistics or restrictions does not mark them as modified;
+    use :meth:`mark_stats_modified` and :meth:`mark_restrict_modified`.
+
+    Users read from the printer fetch their statistics and restrictions from
+    their :class:`UserMaintSession` when they are first accessed.  This needs
+    the session to still be open: once it is closed or collected, accessing
+    data that has not been loaded yet raises :class:`UserMaintError`.  Use
+    :meth:`UserMaintSession.prefetch_all` to load everything up front.
 
     It supports serialisation to and deserialisation from XML using
     :meth:`to_xml` and :meth:`from_xml`.
     """
 
+    __slots__ = ('_user_code', '_orig_user_code', 'name', '_internal_name',
+            'counter_oid', 'restrict_oid', '_restrict', '_stats', '_session')
+
     MAX_NAME_LEN = 20
 
     def __init__(self, user_code, name, restrict=None, stats=None, internal_name=None):
         self._user_code = user_code
-        self.__name = name
-        self._internal_name = internal_name
+        self._orig_user_code = _UNSET
+        self.name = name
+        self.internal_name = internal_name
         self._restrict = restrict
         self._stats = stats
+        self._session = None
 
     def _set_user_code(self, user_code):
-        if not hasattr(self, '_orig_user_code'):
+        if self._orig_user_code is _UNSET:
             # Remember the original user code, as currently known to the
             # printer, so that any changes can be properly associated with that
             # user code.
-            if hasattr(self, '_user_code'):
-                self._orig_user_code = self._user_code
+            self._orig_user_code = self._user_code
+        old_user_code = self._user_code
         self._user_code = user_code
+        if self._session is not None:
+            # Let the session find the user by its new user code right away.
+            try:
+                self._session._reindex_user(self, old_user_code)
+            except ReferenceError:
+                pass
     def _get_user_code(self):
         """The account's user code property."""
         return self._user_code
@@ -303,7 +433,7 @@ class User(object):
 
     def _get_orig_user_code(self):
         """Get the user code assigned to the user on the server-side."""
-        if hasattr(self, '_orig_user_code'):
+        if self._orig_user_code is not _UNSET:
             return self._orig_user_code
         else:
             return self._user_code
@@ -311,52 +441,114 @@ class User(object):
 
     def notify_flushed(self):
         """Inform the object, that the data was flushed to the server."""
-        if hasattr(self, '_orig_user_code'):
-            # The server now knows of the updated user code.
-            del self._orig_user_code
-        if self.stats is not None and self.stats.modified:
-            self.stats.modified = False
-        if self.restrict is not None and self.restrict.modified:
-            self.restrict.modified = False
-
-    def _set_name(self, name):
-        if len(name) > self.MAX_NAME_LEN:
-            raise UserMaintError('user name "%s" too long, max %d ' \
-                    'characters' % (name, self.MAX_NAME_LEN))
-        self.__name = name
-    def _get_name(self):
-        return self.__name
-    name = property(_get_name, _set_name)
-    
-    def _set_internal_name(self, internal_name):
-        self._internal_name = internal_name
-    def _get_internal_name(self):
-        return self._internal_name
-    internal_name = property(_get_internal_name, _set_internal_name)
-    
+        # The server now knows of the updated user code.
+        self._orig_user_code = _UNSET
+        restrict, stats = self.modified_parts()
+        if stats is not None:
+            stats.modified = False
+        if restrict is not None:
+            restrict.modified = False
+
+    def modified_parts(self):
+        """Return the access restrictions and the statistics if they were
+        loaded and modified, ``None`` in their place otherwise."""
+        restrict = self._restrict
+        if restrict is _UNSET or restrict is None or not restrict.modified:
+            restrict = None
+        stats = self._stats
+        if stats is _UNSET or stats is None or not stats.modified:
+            stats = None
+        return restrict, stats
+
+    def _bind_session(self, session):
+        """Load the statistics and restrictions from `session` on first
+        access.  Only a weak reference to `session` is kept, so that the
+        session can be collected while its users are still referenced."""
+        self._session = weakref.proxy(session)
+        self._stats = _UNSET
+        self._restrict = _UNSET
+
     def _get_stats(self):
+        if self._stats is _UNSET:
+            try:
+                stats = self._session._counters[self.internal_name]
+            except ReferenceError:
+                raise UserMaintError("session already closed")
+            if stats is None:
+                # Like users whose statistics could not be read when listing
+                # them, the user is left out from now on.
+                self._session._drop_user(self)
+                raise UserMaintError("could not read the statistics of user "
+                        + str(self.name))
+            self._stats = stats
         return self._stats
     def _set_stats(self, stats):
         self._stats = stats
-        if self._stats is not None:
-            self._stats.modified = True
     stats = property(_get_stats, _set_stats)
-    
+
     def _get_restrict(self):
+        if self._restrict is _UNSET:
+            try:
+                self._restrict = self._session._restricts[self.internal_name]
+            except ReferenceError:
+                raise UserMaintError("session already closed")
         return self._restrict
     def _set_restrict(self, restrict):
         self._restrict = restrict
-        if self._restrict is not None:
-            self._restrict.modified = True
     restrict = property(_get_restrict, _set_restrict)
 
+    @classmethod
+    def check_name(cls, name):
+        """Throw :class:`UserMaintError` if `name` is too long to be used as
+        user name.  Names read from the printer need no check."""
+        max_len = cls.MAX_NAME_LEN
+        if len(name) > max_len:
+            raise UserMaintError('user name "%s" too long, max %d ' \
+                    'characters' % (name, max_len))
+    
+    def _set_internal_name(self, internal_name):
+        self._internal_name = internal_name
+        # The object ids are needed for every update, so they are only built
+        # when the internal name changes.
+        if internal_name is None:
+            self.counter_oid = None
+            self.restrict_oid = None
+        else:
+            self.counter_oid = int(COUNTER_OID_PREFIX + str(internal_name))
+            self.restrict_oid = int(RESTRICT_OID_PREFIX + str(internal_name))
+    def _get_internal_name(self):
+        """The user's name in the user directory.  Setting it also sets the
+        object ids `counter_oid` and `restrict_oid`."""
+        return self._internal_name
+    internal_name = property(_get_internal_name, _set_internal_name)
+
+    def mark_stats_modified(self):
+        """Mark the statistics as modified, e.g. after assigning a new
+        :class:`UserStatistics` instance, so that :meth:`UserMaintSession.set_user_info` sends
+        them to the printer."""
+        if self.stats is not None:
+            self.stats.modified = True
+
+    def mark_restrict_modified(self):
+        """Mark the access restrictions as modified, e.g. after assigning a new
+        :class:`UserRestrict` instance, so that :meth:`UserMaintSession.set_user_info` sends
+        them to the printer."""
+        if self.restrict is not None:
+            self.restrict.modified = True
+
     def __repr__(self):
         return '<User "%s" (#%s, %s, %s, %s)>' % (unicode(self.name),
-                str(self.user_code), str(self.internal_name), str(self.restrict), str(self.stats))
+                str(self.user_code), str(self.internal_name),
+                'unloaded' if self._restrict is _UNSET else str(self._restrict),
+                'unloaded' if self._stats is _UNSET else str(self._stats))
                 
     @staticmethod
     def from_soap_object(obj):
-        items = obj.item.item
+        return User.from_prop_list(obj.item)
+
+    @staticmethod
+    def from_prop_list(prop_list):
+        items = prop_list.item
         name = ""
         code = ""
         for item in items:
@@ -380,83 +572,472 @@ class UserMaintSession(object):
     Objects of this class represent a user maintainance session. They provide
     methods to retrieve and modify user accounts.
 
-    There is no session on the network level: Each request initiates a
-    self-contained SOAP request. There is a session on the API level thought.
+    Each request is a self-contained SOAP request, but the device management
+    session on the API level stays open from construction until :meth:`close`
+    is called, so that users' data can be loaded when first accessed.  The
+    device is locked within this session for modifications.  User directory
+    sessions are only opened while users are looked up or modified.
+
+    Call :meth:`close` when done, or use the object as context manager::
+
+        with UserMaintSession(pass_string, wsdl) as session:
+            ...
+
+    Otherwise the session is only closed when the object is collected.
     """
 
-    def __init__(self, pass_string, wsdl):
+    _DM_NAME = "DeviceManagementService"
+    _UD_NAME = "UserDirectoryService"
+    _USER_COUNTER_CLASS = "usageCounter.userCounter"
+    _USER_RESTRICT_CLASS = "usageControl.userRestrict"
+    # Lock modes of user directory sessions.
+    _UD_LOCK_SHARED = "S"
+    _UD_LOCK_EXCLUSIVE = "X"
+    _COUNTER_FIELDS = COUNTER_FIELDS
+    _RESTRICT_FIELDS = RESTRICT_FIELDS
+    _COUNTER_OID_PREFIX = COUNTER_OID_PREFIX
+    _RESTRICT_OID_PREFIX = RESTRICT_OID_PREFIX
+
+    # Whether the session started by the constructor is still open.
+    _alive = False
+
+    # State of :meth:`batch`: whether a batch is active, whether the device is
+    # locked for it and its exclusive user directory session.
+    _in_batch = False
+    _batch_locked = False
+    _batch_ud_session = None
+
+    def __init__(self, pass_string, wsdl, backend="suds"):
+        """Open a session with password string `pass_string` using the WSDL
+        file at `wsdl`.
+
+        `backend` selects how the user objects are read from the device
+        management service: ``"suds"`` uses the suds client for all requests,
+        ``"raw"`` uses :class:`aficio2060.rawsoap.DeviceManagementClient`
+        (requires :mod:`requests` and :mod:`lxml`).  Modifications are always
+        sent through suds.
+        """
         self.pass_string = pass_string
         self.wsdl = wsdl if wsdl.startswith("file://") else "file://" + wsdl
+
+        self.soap_client = _get_client(self.wsdl)
+        self.dm_service = self.soap_client.service[self._DM_NAME]
+        self.ud_service = self.soap_client.service[self._UD_NAME]
+        from suds import WebFault
+        # SOAP faults for single objects, e.g. for a missing object, after
+        # which reading the remaining objects continues.
+        self._faults = (WebFault,)
+        if backend == "suds":
+            self.dm_reader = None
+        elif backend == "raw":
+            from aficio2060 import rawsoap
+            transport = self.soap_client.options.transport
+            self.dm_reader = rawsoap.DeviceManagementClient(
+                    self._service_location(self._DM_NAME),
+                    getattr(transport, 'http_session', None))
+            self._faults += (rawsoap.Fault,)
+        else:
+            raise UserMaintError('unknown SOAP backend "%s"' % backend)
         
-        logging.basicConfig(level=logging.ERROR)
-        logging.getLogger('suds.client').setLevel(logging.DEBUG)
-        logging.disable(logging.ERROR)
-
-        self.soap_client = Client(self.wsdl, cache=None)
-        self.dm_service = self.soap_client.service["DeviceManagementService"]
-        self.ud_service = self.soap_client.service["UserDirectoryService"]
-        self.dm_session = self.dm_service.StartSession(self.pass_string, 0).stringOut
-        self.ud_session = self.ud_service.StartSession(self.pass_string, 0, "S").stringOut
-        
-        self.users = {}
-        user_counter_ids = self.dm_service.GetObjects(self.dm_session, 0, "usageCounter.userCounter").item
-        user_restrict_ids = self.dm_service.GetObjects(self.dm_session, 0, "usageControl.userRestrict").item
-        
-        for user_counter_id in user_counter_ids:
-            try:
-                user_counter = self.dm_service.GetObject(self.dm_session, 0, user_counter_id, {"item" : ["copyBlack", "copyBlackA3Over", "printerBlack", "printerBlackA3Over", "scannerBlack", "scannerBlackA3Over"]})
-                user_internal_name = user_counter.name
-                tmp_user_stats = UserStatistics.from_soap_object(user_counter)
-                tmp_user_stats.modified = False
-                user_properties = self.ud_service.GetObjectsProps(self.ud_session, { "item" : ["entry:"+str(user_internal_name)] }, { "item" : [ "name", "auth:name" ] }, {})
-                tmp_user = User.from_soap_object(user_properties)
-                tmp_user.internal_name = user_internal_name
-                tmp_user.stats = tmp_user_stats
-                self.users[user_internal_name] = tmp_user
-            except Exception, e:
-                pass
-        
-        for user_restrict_id in user_restrict_ids:
+        # The device management session stays open for the lifetime of this
+        # object, so that the users' statistics and restrictions can be read
+        # when they are first needed.  User directory sessions are only opened
+        # while they are used, see :meth:`_ud_read_session`.
+        self.dm_session = self._start_dm_session()
+        self._alive = True
+
+        self._counters = _LazyDict(UserMaintSession._fetch_stats, self)
+        self._restricts = _LazyDict(UserMaintSession._fetch_restrict, self)
+
+    def _service_location(self, service_name):
+        """Get the URL of service `service_name` as declared in the WSDL."""
+        for service in self.soap_client.wsdl.services:
+            if service.name == service_name:
+                return service.ports[0].location
+        raise UserMaintError('service "%s" not found in WSDL' % service_name)
+
+    def _parallel(self, *calls):
+        """Run the (function, arguments) pairs `calls` and return the list of
+        their results.
+
+        The calls run in parallel threads only with the raw backend, where at
+        most one of them uses suds.  suds clients must not be used by several
+        threads at once: their schema objects are resolved lazily and without
+        locking.
+        """
+        if self.dm_reader is None:
+            return [function(*args) for function, args in calls]
+        pool = ThreadPool(len(calls))
+        try:
+            results = [pool.apply_async(function, args)
+                    for function, args in calls]
+            return [result.get() for result in results]
+        finally:
+            pool.close()
+
+    def _start_dm_session(self):
+        """Start a device management session and return its session string."""
+        if self.dm_reader is not None:
+            return self.dm_reader.start_session(self.pass_string)
+        return self.dm_service.StartSession(self.pass_string, 0).stringOut
+
+    def _terminate_dm_session(self):
+        if self.dm_reader is not None:
+            self.dm_reader.terminate_session(self.dm_session)
+        else:
+            self.dm_service.TerminateSession(self.dm_session)
+
+    def _get_objects(self, object_class):
+        """Get the ids of all objects of class `object_class`."""
+        if self.dm_reader is not None:
+            return self.dm_reader.get_objects(self.dm_session, object_class)
+        return self.dm_service.GetObjects(self.dm_session, 0, object_class).item
+
+    def _get_object(self, object_id, field_names):
+        """Get the fields in tuple `field_names` of object `object_id`.
+        Returns the object's name and a list of (field name, value) pairs."""
+        if self.dm_reader is not None:
+            return self.dm_reader.get_object(self.dm_session, object_id,
+                    field_names)
+        obj = self.dm_service.GetObject(self.dm_session, 0, object_id,
+                _field_list(field_names))
+        return obj.name, _field_items(obj)
+
+    def _lookup_users(self, internal_names):
+        """Get the users with the internal names `internal_names` from the
+        user directory.  Returns a dictionary of :class:`User` instances by
+        internal name.  Users that cannot be looked up are left out."""
+        if len(internal_names) == 0:
+            return {}
+        with self._ud_read_session() as ud_session:
+            return self._lookup_users_in(ud_session, internal_names)
+
+    def _lookup_users_in(self, ud_session, internal_names):
+        """Like :meth:`_lookup_users`, using the user directory session
+        `ud_session`."""
+        # The device management service has no bulk getter, but the user
+        # directory does: Look up the names and user codes of all users in a
+        # single request instead of one request per user.
+        try:
+            user_properties = self.ud_service.GetObjectsProps(ud_session, { "item" : ["entry:"+str(internal_name) for internal_name in internal_names] }, { "item" : [ "name", "auth:name" ] }, {})
+            prop_lists = _as_list(getattr(user_properties, 'item', []))
+        except self._faults, e:
+            prop_lists = []
+        # The reply does not name the entries, so they can only be matched to
+        # the requested names by position, which requires exactly one entry
+        # per name.  Otherwise look the users up one by one.
+        if len(prop_lists) == len(internal_names):
             try:
-                user_restrict = self.dm_service.GetObject(self.dm_session, 0, user_restrict_id, {"item" : ["copyBlack", "printerBlack", "scannerBlack", "localStorage"]})
-                if user_restrict.name in self.users:
-                    self.users[user_restrict.name].restrict = UserRestrict.from_soap_object(user_restrict)
-            except Exception, e:
+                return dict(zip(internal_names,
+                        [User.from_prop_list(prop_list)
+                            for prop_list in prop_lists]))
+            except (AttributeError, ValueError), e:
                 pass
+        users = {}
+        for internal_name in internal_names:
+            user = self._lookup_user(ud_session, internal_name)
+            if user is not None:
+                users[internal_name] = user
+        return users
+
+    def _lookup_user(self, ud_session, internal_name):
+        """Get the user with the internal name `internal_name` from the user
+        directory using session `ud_session`, or ``None`` if it cannot be
+        looked up."""
+        try:
+            user_properties = self.ud_service.GetObjectsProps(ud_session, { "item" : ["entry:"+str(internal_name)] }, { "item" : [ "name", "auth:name" ] }, {})
+        except self._faults, e:
+            return None
+        try:
+            return User.from_soap_object(user_properties)
+        except (AttributeError, ValueError), e:
+            return None
+
+    def _read_objects(self, object_ids, field_names, from_fields):
+        """Get the fields in tuple `field_names` of all objects `object_ids`
+        and convert them using `from_fields`.  Returns a list of (object name,
+        converted object) pairs.  Objects that cannot be read are skipped.
+
+        The device management service offers neither GetObjectsProps nor any
+        other bulk getter, so this costs one GetObject request per object.
+        """
+        objects = []
+        # Bound to locals once instead of looked up in every iteration.
+        read_object = self._read_object
+        append = objects.append
+        for object_id in object_ids:
+            obj = read_object(object_id, field_names, from_fields)
+            if obj is not None:
+                append(obj)
+        return objects
+
+    def _read_object(self, object_id, field_names, from_fields):
+        """Get the fields in tuple `field_names` of object `object_id` and
+        convert them using `from_fields`.  Returns the object's name and the
+        converted object, or ``None`` if the object cannot be read."""
+        try:
+            name, fields = self._get_object(object_id, field_names)
+        except self._faults, e:
+            return None
+        if not fields:
+            return None
+        try:
+            return name, from_fields(fields)
+        except (AttributeError, ValueError), e:
+            return None
+
+    def _fetch_stats(self, internal_name):
+        """Read the statistics of the user with internal name
+        `internal_name`, or ``None`` if they cannot be read."""
+        if not self._alive:
+            raise UserMaintError("session already closed")
+        obj = self._read_object(
+                int(self._COUNTER_OID_PREFIX + str(internal_name)),
+                self._COUNTER_FIELDS, UserStatistics.from_fields)
+        return obj[1] if obj is not None else None
+
+    def _fetch_restrict(self, internal_name):
+        """Read the restrictions of the user with internal name
+        `internal_name`, or ``None`` if they cannot be read."""
+        if not self._alive:
+            raise UserMaintError("session already closed")
+        obj = self._read_object(
+                int(self._RESTRICT_OID_PREFIX + str(internal_name)),
+                self._RESTRICT_FIELDS, UserRestrict.from_fields)
+        return obj[1] if obj is not None else None
+
+    @_cached_property
+    def _user_ids(self):
+        """The object ids of all user counters."""
+        return self._get_objects(self._USER_COUNTER_CLASS)
+
+    @_cached_property
+    def users(self):
+        """All users by internal name.  Their statistics and restrictions are
+        only loaded when accessed, or by :meth:`prefetch_all`.  Users whose
+        statistics turn out not to be readable are removed."""
+        prefix_len = len(self._COUNTER_OID_PREFIX)
+        internal_names = [int(str(user_counter_id)[prefix_len:])
+                for user_counter_id in self._user_ids]
+        users = self._lookup_users(internal_names)
+        for internal_name, user in users.iteritems():
+            user.internal_name = internal_name
+            user._bind_session(self)
+        return users
+
+    @_cached_property
+    def _by_code(self):
+        """Index of :attr:`users` by user code.  It is kept up to date by
+        :meth:`add_user`, :meth:`delete_user` and :meth:`set_user_info`."""
+        return dict((user.user_code, user)
+                for user in self.users.itervalues())
+
+    def _drop_user(self, user):
+        """Remove `user` from :attr:`users` and the user code index."""
+        if self.users.get(user.internal_name) is user:
+            del self.users[user.internal_name]
+        if '_by_code' in self.__dict__ and \
+                self._by_code.get(user.user_code) is user:
+            del self._by_code[user.user_code]
+
+    def _reindex_user(self, user, old_user_code):
+        """Move `user` from `old_user_code` to its current user code in the
+        user code index, if the index was built yet and `user` is one of
+        :attr:`users`."""
+        if '_by_code' not in self.__dict__ or \
+                self.users.get(int(user.internal_name)) is not user:
+            return
+        if self._by_code.get(old_user_code) is user:
+            del self._by_code[old_user_code]
+        self._by_code[user.user_code] = user
+
+    def prefetch_all(self):
+        """Read the statistics and restrictions of all users at once, instead
+        of each when first accessed.  Both object classes are read in
+        parallel where possible."""
+        def read_restricts():
+            return self._read_objects(
+                    self._get_objects(self._USER_RESTRICT_CLASS),
+                    self._RESTRICT_FIELDS, UserRestrict.from_fields)
+        user_stats, user_restricts = self._parallel(
+                (self._read_objects, (self._user_ids, self._COUNTER_FIELDS,
+                    UserStatistics.from_fields)),
+                (read_restricts, ()))
+        for internal_name in self.users:
+            self._counters.setdefault(internal_name, None)
+            self._restricts.setdefault(internal_name, None)
+        self._counters.update(user_stats)
+        self._restricts.update(user_restricts)
+        # Leave out the users whose statistics cannot be read.
+        for internal_name, stats in self._counters.items():
+            user = self.users.get(internal_name)
+            if stats is None and user is not None:
+                self._drop_user(user)
         
-        self.dm_service.TerminateSession(self.dm_session)
-        del self.dm_session
-        self.ud_service.TerminateSession(self.ud_session)
-        del self.ud_session
-        
-        if "SUDS_DEBUG" in os.environ.keys():
-            logging.disable(logging.NOTSET)
-        
+    def close(self):
+        """Terminate the session with the device.  Statistics and
+        restrictions of users that have not been loaded yet cannot be loaded
+        afterwards.  Called when the object is collected, if not before."""
+        if self._alive:
+            self._alive = False
+            self._terminate_dm_session()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
     def __del__(self):
-        if hasattr(self, 'dm_service') and hasattr(self, 'dm_session'):
-            self.dm_service.TerminateSession(self.dm_session)
-        if hasattr(self, 'ud_service') and hasattr(self, 'ud_session'):
-            self.ud_service.TerminateSession(self.ud_session)
+        self.close()
+
+    def load_counters_bulk(self):
+        """Read the counters of all user accounts into NumPy arrays instead of
+        :class:`UserStatistics` instances.  Returns a pair of arrays: the user
+        codes and, in the same order, the users' counters as structured array
+        of dtype :data:`aficio2060.counters.COUNTER_DTYPE`.  See
+        :mod:`aficio2060.counters` for functions working on these arrays.
+        Requires :mod:`numpy`.
+        """
+        from aficio2060 import counters
+
+        user_counter_ids = self._user_ids
+        counter_array = counters.empty(len(user_counter_ids))
+        internal_names = []
+        read_object = self._read_object
+        field_names = self._COUNTER_FIELDS
+        record_from_fields = counters.record_from_fields
+        for user_counter_id in user_counter_ids:
+            obj = read_object(user_counter_id, field_names, record_from_fields)
+            if obj is None:
+                continue
+            user_internal_name, record = obj
+            counter_array[len(internal_names)] = record
+            internal_names.append(user_internal_name)
+        # Users missing from the user directory are left out.
+        users = self._lookup_users(internal_names)
+        rows = [row for row, internal_name in enumerate(internal_names)
+                if internal_name in users]
+        user_codes = counters.user_code_array([users[internal_names[row]].user_code
+                for row in rows])
+        return user_codes, counter_array[rows]
+
+    def summary(self):
+        """Read the counters of all user accounts and return their A4
+        equivalent totals as NumPy arrays: a tuple of the user codes, the
+        copy totals, the print totals and the scan totals.  Suited for reports
+        over all users; see :func:`aficio2060.counters.nonzero_mask` for
+        finding the users with non-zero totals.  Requires :mod:`numpy`, uses
+        :mod:`numba` if available.
+        """
+        from aficio2060 import counters
+
+        user_codes, counter_array = self.load_counters_bulk()
+        copy_total, print_total, scan_total = counters.a4_totals(counter_array)
+        return user_codes, copy_total, print_total, scan_total
+
+    @contextmanager
+    def batch(self):
+        """Context manager for a series of modifications, e.g.::
+
+            with session.batch():
+                for user in users:
+                    session.set_user_info(user)
+
+        Within the batch, the device is locked and an exclusive user directory
+        session is opened only once, on the first modification that needs
+        them, instead of once per modification.  Both are released when the
+        batch ends.
+        """
+        if self._in_batch:
+            yield
+            return
+        self._in_batch = True
+        try:
+            yield
+        finally:
+            self._in_batch = False
+            try:
+                if self._batch_locked:
+                    self._batch_locked = False
+                    self.dm_service.UnlockDevice(self.dm_session, 0)
+            finally:
+                if self._batch_ud_session is not None:
+                    ud_session = self._batch_ud_session
+                    self._batch_ud_session = None
+                    self.ud_service.TerminateSession(ud_session)
+
+    @contextmanager
+    def _device_lock(self):
+        """Lock the device for modifications, unless a batch already holds
+        the lock."""
+        if self._in_batch:
+            if not self._batch_locked:
+                self.dm_service.LockDevice(self.dm_session, 0, 0)
+                self._batch_locked = True
+            yield
+            return
+        self.dm_service.LockDevice(self.dm_session, 0, 0)
+        # The session outlives this call, so the device must be unlocked even
+        # if an update fails.
+        try:
+            yield
+        finally:
+            self.dm_service.UnlockDevice(self.dm_session, 0)
+
+    @contextmanager
+    def _ud_read_session(self):
+        """Provide a user directory session for reading.  Within a batch that
+        holds an exclusive session, that session is used.  Otherwise a shared
+        session is opened for the duration of the read, so that a shared and
+        an exclusive session are never held at the same time."""
+        if self._batch_ud_session is not None:
+            yield self._batch_ud_session
+            return
+        ud_session = self.ud_service.StartSession(self.pass_string, 0,
+                self._UD_LOCK_SHARED).stringOut
+        try:
+            yield ud_session
+        finally:
+            self.ud_service.TerminateSession(ud_session)
+
+    @contextmanager
+    def _ud_write_session(self):
+        """Provide an exclusive user directory session for modifications."""
+        if self._in_batch:
+            if self._batch_ud_session is None:
+                self._batch_ud_session = self.ud_service.StartSession(
+                        self.pass_string, 0, self._UD_LOCK_EXCLUSIVE).stringOut
+            yield self._batch_ud_session
+            return
+        ud_session = self.ud_service.StartSession(self.pass_string, 0,
+                self._UD_LOCK_EXCLUSIVE).stringOut
+        try:
+            yield ud_session
+        finally:
+            self.ud_service.TerminateSession(ud_session)
 
     def add_user(self, user):
         """Add object `user` of type :class:`User` as user account."""
-        self.ud_session = self.ud_service.StartSession(self.pass_string, 0, "X").stringOut
-        response = self.ud_service.PutObjects(self.ud_session, "entry", {}, user.to_propListList(), {})
-        user.internal_name = response.item
-        self.ud_service.TerminateSession(self.ud_session)
-        del self.ud_session
+        User.check_name(user.name)
+        with self._ud_write_session() as ud_session:
+            response = self.ud_service.PutObjects(ud_session, "entry", {}, user.to_propListList(), {})
+            user.internal_name = response.item
         
-        self.dm_session = self.dm_service.StartSession(self.pass_string, 0).stringOut
-        lock = self.dm_service.LockDevice(self.dm_session, 0, 0)
-        response = self.dm_service.UpdateObject(self.dm_session, 0, { "name" : int(user.internal_name), 
-                                                                      "class" : "usageControl.userRestrict", 
-                                                                      "oid" : int("110002"+str(user.internal_name)),
-                                                                      "fieldList" : user.restrict.to_fieldList() },
-                                                                    { "item" : { "propName" : "replaceAll", "propVal" : "false" } } )
-        unlock = self.dm_service.UnlockDevice(self.dm_session, 0)
-        self.dm_service.TerminateSession(self.dm_session)
-        del self.dm_session
+        dm_session = self.dm_session
+        with self._device_lock():
+            response = self.dm_service.UpdateObject(dm_session, 0, { "name" : int(user.internal_name), 
+                                                                          "class" : self._USER_RESTRICT_CLASS,
+                                                                          "oid" : user.restrict_oid,
+                                                                          "fieldList" : user.restrict.to_fieldList() },
+                                                                        { "item" : { "propName" : "replaceAll", "propVal" : "false" } } )
+            return_value = response.returnValue
+            if return_value != "OK":
+                raise UserMaintError("Could not set the user restrictions for user " + str(user.name))
         
+        if 'users' in self.__dict__:
+            self.users[int(user.internal_name)] = user
+        self._reindex_user(user, user.user_code)
         user.notify_flushed()
 
     def delete_user(self, user_code):
@@ -465,19 +1046,19 @@ class UserMaintSession(object):
         if user == None:
             return
        
-        self.ud_session = self.ud_service.StartSession(self.pass_string, 0, "X").stringOut
-        
-        response = self.ud_service.PutObjectProps(self.ud_session, "entry:" + str(user.internal_name),
-                                                    { "item" : { "propName" : "auth:", "propVal" : "false" } },
-                                                    { "item" : { "propName" : "replaceAll", "propVal" : "false" } } )
-        self.ud_service.TerminateSession(self.ud_session)
-        del self.ud_session
+        with self._ud_write_session() as ud_session:
+            response = self.ud_service.PutObjectProps(ud_session, "entry:" + str(user.internal_name),
+                                                        { "item" : { "propName" : "auth:", "propVal" : "false" } },
+                                                        { "item" : { "propName" : "replaceAll", "propVal" : "false" } } )
+        del self._by_code[user_code]
+        del self.users[int(user.internal_name)]
 
 
     def get_user_info(self, user_code):
         """Get information about user account with user code number `user_code`.
         Returns a :class:`User` instance in case the user was found or else
-        throws :class:`UserMaintError`.
+        throws :class:`UserMaintError`.  Users are found by their current user
+        code, even before a changed code is sent to the printer.
         If `req_user_code` is ``True``, the user's user code is requested.
         If `req_user_code_name` is ``True``, the user's name is requested.
         If `req_restrict_info` is ``True``, the user's access restrictions are
@@ -485,10 +1066,7 @@ class UserMaintSession(object):
         If `req_statistics_info` is ``True``, the user's printing statistics are
         requested.
         """
-        for user_internal_name, user in self.users.iteritems():
-            if user.user_code == user_code:
-                return user
-        return None
+        return self._by_code.get(user_code)
 
     def get_user_infos(self):
         """Request information about all user accounts.
@@ -507,26 +1085,31 @@ class UserMaintSession(object):
         """Modify user account associated with `user`, which is an instance of
         :class:`User`.
         Throws :class:`UserMaintError` in case of an error.
+        Nothing is sent to the printer if `user` was not modified.
         """
-        self.dm_session = self.dm_service.StartSession(self.pass_string, 0).stringOut
-        lock = self.dm_service.LockDevice(self.dm_session, 0, 0)
-        if user.restrict != None and user.restrict.modified:
-            response = self.dm_service.UpdateObject(self.dm_session, 0, { "name" : int(user.internal_name), 
-                                                                          "class" : "usageControl.userRestrict", 
-                                                                          "oid" : int("110002"+str(user.internal_name)),
-                                                                          "fieldList" : user.restrict.to_fieldList() },
-                                                                        { "item" : { "propName" : "replaceAll", "propVal" : "false" } } )
-            if response.returnValue != "OK":
-                raise UserMaintError("Could not update the user restrictions for user " + str(user.name))
-        if user.stats != None and user.stats.modified:
-            response = self.dm_service.UpdateObject(self.dm_session, 0, { "name" : int(user.internal_name), 
-                                                                          "class" : "usageCounter.userCounter", 
-                                                                          "oid" : int("111002"+str(user.internal_name)),
-                                                                          "fieldList" : user.stats.to_fieldList() },
-                                                                        { "item" : { "propName" : "replaceAll", "propVal" : "false" } } )
-            if response.returnValue != "OK":
-                raise UserMaintError("Could not update the user counter for user " + str(user.name))
-        unlock = self.dm_service.UnlockDevice(self.dm_session, 0)
-        self.dm_service.TerminateSession(self.dm_session)
-        del self.dm_session
+        restrict, stats = user.modified_parts()
+        if user.orig_user_code == user.user_code and restrict is None and \
+                stats is None:
+            return
+        dm_session = self.dm_session
+        with self._device_lock():
+            if restrict is not None:
+                response = self.dm_service.UpdateObject(dm_session, 0, { "name" : int(user.internal_name), 
+                                                                              "class" : self._USER_RESTRICT_CLASS,
+                                                                              "oid" : user.restrict_oid,
+                                                                              "fieldList" : restrict.to_fieldList() },
+                                                                            { "item" : { "propName" : "replaceAll", "propVal" : "false" } } )
+                return_value = response.returnValue
+                if return_value != "OK":
+                    raise UserMaintError("Could not update the user restrictions for user " + str(user.name))
+            if stats is not None:
+                response = self.dm_service.UpdateObject(dm_session, 0, { "name" : int(user.internal_name), 
+                                                                              "class" : self._USER_COUNTER_CLASS,
+                                                                              "oid" : user.counter_oid,
+                                                                              "fieldList" : stats.to_fieldList() },
+                                                                            { "item" : { "propName" : "replaceAll", "propVal" : "false" } } )
+                return_value = response.returnValue
+                if return_value != "OK":
+                    raise UserMaintError("Could not update the user counter for user " + str(user.name))
+        self._reindex_user(user, user.orig_user_code)
         user.notify_flushed()
@@ -19,14 +19,16 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
 
+from bisect import bisect_right
+from collections import namedtuple
+from operator import attrgetter
+import re
 
 CONFIG_PATH = '/etc/aficio2060.conf'
 
-def list_to_dict(attr_name, list):
-    d = {}
-    for e in list:
-        d[getattr(e, attr_name)] = e
-    return d
+def list_to_dict(attr_name, elements):
+    key = attrgetter(attr_name)
+    return {key(e): e for e in elements}
 
 def comma_string_to_list(s):
     return [e.strip() for e in s.split(',')]
@@ -35,11 +37,59 @@ def region_to_int_pair(s):
     start, end = s.split('-')
     return (int(start.strip()), int(end.strip()))
 
+# One region of a comma separated list, e.g. "1000 - 1999,".
+_REGION_RE = re.compile(r'\s*(\d+)\s*-\s*(\d+)\s*(,|\Z)')
+
 def str_to_code_regions(s):
-    return [region_to_int_pair(region) for region in comma_string_to_list(s)]
+    regions = []
+    pos = 0
+    for m in _REGION_RE.finditer(s):
+        # finditer skips over text it cannot match, which is malformed input.
+        if m.start() != pos:
+            break
+        regions.append((int(m.group(1)), int(m.group(2))))
+        pos = m.end()
+    if pos != len(s) or not regions or m.group(3) == ',':
+        raise ValueError('invalid user code regions: %r' % s)
+    return regions
+
+# Sorted, non-overlapping user code regions, as returned by
+# :func:`compile_regions`.  The i-th region spans starts[i] to ends[i].
+CodeRegions = namedtuple('CodeRegions', ('starts', 'ends'))
+
+def compile_regions(regions):
+    """Convert a list of (start, end) pairs, as returned by
+    :func:`str_to_code_regions`, into a :class:`CodeRegions` instance, which
+    speeds up :func:`user_code_within_regions`.  Overlapping and adjacent
+    regions are merged."""
+    starts = []
+    ends = []
+    for start, end in sorted(regions):
+        if ends and start <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return CodeRegions(starts, ends)
 
 def user_code_within_regions(code, regions):
-    for region in regions:
-        if code >= region[0] and code <= region[1]:
-            return True
-    return False
+    """Is `code` within one of `regions`?  Pass the regions through
+    :func:`compile_regions` first, when checking more than one code."""
+    if not isinstance(regions, CodeRegions):
+        regions = compile_regions(regions)
+    i = bisect_right(regions.starts, code) - 1
+    return i >= 0 and code <= regions.ends[i]
+
+def classify_codes_np(codes, regions):
+    """Return a boolean NumPy array, which is ``True`` for each of the user
+    codes `codes` within one of `regions`.  Requires :mod:`numpy`."""
+    import numpy as np
+    if not isinstance(regions, CodeRegions):
+        regions = compile_regions(regions)
+    codes = np.asarray(codes, dtype=np.int64)
+    if not regions.starts:
+        return np.zeros(codes.shape, dtype=bool)
+    starts = np.array(regions.starts, dtype=np.int64)
+    ends = np.array(regions.ends, dtype=np.int64)
+    idx = np.searchsorted(starts, codes, side='right') - 1
+    return (idx >= 0) & (codes <= ends[np.maximum(idx, 0)])
@@ -0,0 +1,94 @@
+# vim:set ft=python ts=4 sw=4 et fileencoding=utf-8:
+
+# aficio2060/counters.py -- Bulk handling of user counters as NumPy arrays.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
+
+"""
+Support for :meth:`aficio2060.accounts.UserMaintSession.load_counters_bulk`,
+which stores the counters of all users in a single NumPy structured array of
+dtype :data:`COUNTER_DTYPE` (one row of 24 bytes per user) instead of one
+:class:`aficio2060.accounts.UserStatistics` instance per user.  Reports over
+all users can then be computed with vectorised operations, e.g.
+``counters['copy_a4'] + 2 * counters['copy_a3']``.
+"""
+
+import numpy as np
+try:
+    import numba
+except ImportError:
+    # The aggregations fall back to plain NumPy expressions.
+    numba = None
+
+from aficio2060.accounts import UserStatistics
+
+# One field per counter attribute of UserStatistics, in the order of its
+# constructor's arguments, which is also the order of
+# aficio2060.accounts.COUNTER_FIELDS.
+COUNTER_DTYPE = np.dtype([(name, '<u4') for name in UserStatistics.__slots__
+        if name in UserStatistics._TRACKED])
+
+def empty(size):
+    """Return a zeroed counter array for `size` users."""
+    return np.zeros(size, dtype=COUNTER_DTYPE)
+
+def record_from_fields(fields):
+    """Convert a sequence of (field name, value) pairs, as read from a user
+    counter object, into a record tuple for a counter array."""
+    return tuple(UserStatistics.values_from_fields(fields))
+
+def user_code_array(user_codes):
+    return np.array(user_codes, dtype='<u4')
+
+def _totals(copy_a4, copy_a3, print_a4, print_a3, scan_a4, scan_a3):
+    return (copy_a4 + 2 * copy_a3, print_a4 + 2 * print_a3,
+            scan_a4 + 2 * scan_a3)
+
+def _nonzero_mask_loop(copy_total, print_total, scan_total):
+    out = np.empty(copy_total.size, np.bool_)
+    for i in numba.prange(copy_total.size):
+        out[i] = (copy_total[i] | print_total[i] | scan_total[i]) != 0
+    return out
+
+def _nonzero_mask_np(copy_total, print_total, scan_total):
+    return (copy_total | print_total | scan_total) != 0
+
+# With Numba the kernels are compiled to parallel machine code.  The compiled
+# code is cached on disk to avoid paying for the compilation on every start.
+if numba is not None:
+    _totals = numba.njit(cache=True, parallel=True)(_totals)
+    _nonzero_mask = numba.njit(cache=True, parallel=True)(_nonzero_mask_loop)
+else:
+    _nonzero_mask = _nonzero_mask_np
+
+def a4_totals(counters):
+    """Return the A4 equivalent copy, print and scan totals of all users, as
+    computed by :attr:`UserStatistics.copy_a4_total` etc.  The totals are
+    int64 arrays, as they can exceed the range of the uint32 counters."""
+    # Widen before the arithmetic, so that both the NumPy and the Numba code
+    # path compute in int64 instead of wrapping around.
+    fields = [counters[name].astype(np.int64) for name in COUNTER_DTYPE.names]
+    return _totals(*fields)
+
+def nonzero_mask(copy_total, print_total, scan_total):
+    """Return a boolean array which is ``True`` for all users with at least
+    one non-zero total, i.e. the negation of :meth:`UserStatistics.is_zero`.
+    The totals are the arrays returned by :func:`a4_totals`."""
+    return _nonzero_mask(copy_total, print_total, scan_total)
+
+def to_user_statistics(record):
+    """Create an unmodified :class:`UserStatistics` instance from the counter
+    array entry `record`."""
+    return UserStatistics(*[int(value) for value in record])
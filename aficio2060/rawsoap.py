@@ -0,0 +1,167 @@
+# vim:set ft=python ts=4 sw=4 et fileencoding=utf-8:
+
+# aficio2060/rawsoap.py -- Light-weight client for the read-only operations of
+#   the printer's device management SOAP service.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
+
+"""
+Loading the counters of all users means one GetObject request per user.  suds
+builds a full object tree for each of those replies, which makes its
+(un)marshaller the dominant client-side cost.  :class:`DeviceManagementClient`
+instead fills prepared XML templates, POSTs them through a pooled
+:mod:`requests` session and parses the replies incrementally with
+:func:`lxml.etree.iterparse` while they are being received.
+
+Only the operations needed to read objects are implemented.  Everything else
+is left to suds.
+"""
+
+from string import Template
+from xml.sax.saxutils import escape
+
+from lxml import etree
+import requests
+
+DM_NS = 'http://www.ricoh.co.jp/xmlns/soap/rdh/devicemanagement'
+
+# Raised for SOAP faults, which are sent with HTTP status 500.
+Fault = requests.HTTPError
+
+ENVELOPE = Template('<?xml version="1.0" encoding="UTF-8"?>'
+        '<SOAP-ENV:Envelope '
+        'xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+        'xmlns:dm="' + DM_NS + '">'
+        '<SOAP-ENV:Body>${body}</SOAP-ENV:Body></SOAP-ENV:Envelope>')
+
+START_SESSION = Template('<dm:startSession>'
+        '<stringIn>${pass_string}</stringIn><timeLimit>0</timeLimit>'
+        '</dm:startSession>')
+
+TERMINATE_SESSION = Template('<dm:terminateSession>'
+        '<sessionId>${session}</sessionId>'
+        '</dm:terminateSession>')
+
+GET_OBJECTS = Template('<dm:getObjects>'
+        '<sessionId>${session}</sessionId><deviceId>0</deviceId>'
+        '<objectClass>${object_class}</objectClass>'
+        '</dm:getObjects>')
+
+GET_OBJECT = Template('<dm:getObject>'
+        '<sessionId>${session}</sessionId><deviceId>0</deviceId>'
+        '<objectId>${object_id}</objectId>'
+        '<fieldList>${field_list}</fieldList>'
+        '</dm:getObject>')
+
+_field_list_xml_cache = {}
+
+def field_list_xml(field_names):
+    """Render the ``fieldList`` items of a GetObject request for the tuple of
+    field names `field_names`.  Each tuple is only rendered once."""
+    xml = _field_list_xml_cache.get(field_names)
+    if xml is None:
+        xml = ''.join(['<item>%s</item>' % escape(name)
+                for name in field_names])
+        _field_list_xml_cache[field_names] = xml
+    return xml
+
+class DeviceManagementClient(object):
+    """Client for the read-only subset of the DeviceManagementService at URL
+    `location`.  Sessions started here are ordinary printer sessions, so they
+    may also be used through suds and vice versa."""
+
+    def __init__(self, location, http_session=None):
+        self.location = location
+        if http_session is None:
+            http_session = requests.Session()
+        self.http_session = http_session
+
+    def _call(self, action, body):
+        """POST request `body` for operation `action`.  The reply is not
+        read yet; it is parsed straight off the socket from ``response.raw``,
+        so callers must close the returned response."""
+        response = self.http_session.post(self.location,
+                data=ENVELOPE.substitute(body=body).encode('utf-8'),
+                headers={
+                    'Content-Type' : 'text/xml; charset=utf-8',
+                    'SOAPAction' : '"%s#%s"' % (DM_NS, action) },
+                stream=True)
+        try:
+            response.raise_for_status()
+        except Fault:
+            # The fault is not read, so the connection is only returned to
+            # the pool if the response is closed.
+            response.close()
+            raise
+        response.raw.decode_content = True
+        return response
+
+    def start_session(self, pass_string):
+        """Start a session and return the session string."""
+        response = self._call('startSession',
+                START_SESSION.substitute(pass_string=escape(pass_string)))
+        try:
+            for event, elem in etree.iterparse(response.raw, tag='stringOut'):
+                return elem.text
+        finally:
+            response.close()
+        raise RuntimeError('startSession reply lacks a session string')
+
+    def terminate_session(self, session):
+        response = self._call('terminateSession',
+                TERMINATE_SESSION.substitute(session=session))
+        response.close()
+
+    def get_objects(self, session, object_class):
+        """Return the ids of all objects of class `object_class`."""
+        response = self._call('getObjects', GET_OBJECTS.substitute(
+                session=session, object_class=escape(object_class)))
+        ids = []
+        try:
+            for event, elem in etree.iterparse(response.raw, tag='item'):
+                ids.append(int(elem.text))
+                _release(elem)
+        finally:
+            response.close()
+        return ids
+
+    def get_object(self, session, object_id, field_names):
+        """Fetch the fields in tuple `field_names` of object `object_id`.
+        Returns the
+        object's name and a list of (field name, value) pairs."""
+        response = self._call('getObject', GET_OBJECT.substitute(
+                session=session, object_id=object_id,
+                field_list=field_list_xml(field_names)))
+        name = None
+        fields = []
+        try:
+            for event, elem in etree.iterparse(response.raw,
+                    tag=('name', 'item')):
+                if elem.tag == 'item':
+                    fields.append((elem.findtext('name'),
+                            elem.findtext('value')))
+                    _release(elem)
+                elif elem.getparent().tag != 'item':
+                    name = int(elem.text)
+        finally:
+            response.close()
+        return name, fields
+
+def _release(elem):
+    """Free `elem` and its already processed preceding siblings, so that the
+    parsed tree stays small however long the reply is."""
+    elem.clear()
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
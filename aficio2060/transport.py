@@ -0,0 +1,70 @@
+# vim:set ft=python ts=4 sw=4 et fileencoding=utf-8:
+
+# aficio2060/transport.py -- suds transport using a persistent requests
+#   session.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
+
+"""
+suds' default transport is based on :mod:`urllib2`, which opens a new TCP
+connection for every SOAP request and never asks for compressed replies.
+:class:`RequestsTransport` sends the requests through a :mod:`requests`
+session instead, which keeps the connection to the printer alive and accepts
+gzip/deflate encoded replies.
+"""
+
+from io import BytesIO
+import httplib
+
+from suds.transport import Reply, TransportError
+from suds.transport.https import HttpAuthenticated
+import requests
+import requests.adapters
+
+def make_http_session():
+    """Create a :class:`requests.Session` with a small connection pool, as all
+    requests go to the same printer."""
+    http_session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+    http_session.mount('http://', adapter)
+    http_session.mount('https://', adapter)
+    http_session.headers.update({
+            'Connection' : 'keep-alive',
+            'Accept-Encoding' : 'gzip, deflate' })
+    return http_session
+
+class RequestsTransport(HttpAuthenticated):
+    """suds transport that sends SOAP requests using the
+    :class:`requests.Session` `http_session`.  Documents, like the WSDL, are
+    still opened by the inherited :mod:`urllib2` code, which also handles
+    ``file://`` URLs."""
+
+    def __init__(self, http_session=None, **kwargs):
+        HttpAuthenticated.__init__(self, **kwargs)
+        if http_session is None:
+            http_session = make_http_session()
+        self.http_session = http_session
+
+    def send(self, request):
+        self.addcredentials(request)
+        # requests transparently decodes gzip/deflate encoded replies.
+        response = self.http_session.post(request.url, data=request.message,
+                headers=request.headers, timeout=self.options.timeout)
+        if response.status_code in (httplib.ACCEPTED, httplib.NO_CONTENT):
+            return None
+        if response.status_code != httplib.OK:
+            raise TransportError(response.reason, response.status_code,
+                    BytesIO(response.content))
+        return Reply(httplib.OK, response.headers, response.content)